@@ -1,7 +1,17 @@
+import hashlib
+import io
+import os
+from collections import namedtuple
+from datetime import datetime
+from math import sqrt
+from pathlib import Path
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 
 # ---------------------------------------------------------
 # 1. Page Config & Title
@@ -19,74 +29,316 @@ st.markdown("""
 # ---------------------------------------------------------
 # 2. Data Loading & Processing (The "Universal Adapter")
 # ---------------------------------------------------------
-@st.cache_data
-def load_and_process_data(file):
-    # 1. Read Data (Try CSV first, then Excel)
+
+# Intelligent Mapping: various possible header names -> our Standard
+# Internal Names, keyed by the strip/title-normalized header.
+_COLUMN_MAPPING = {
+    # Standard: 'Store'
+    'Branch': 'Store',
+    'Store Name': 'Store',
+
+    # Standard: 'SKU' (We treat Product Line or Dept as SKU for analysis)
+    'Product Line': 'SKU',
+    'Dept': 'SKU',
+    'Category': 'SKU',
+
+    # Standard: 'Quantity' (Crucial for EOQ)
+    'Qty': 'Quantity',
+    'Sales Qty': 'Quantity',
+
+    # Standard: 'Price'
+    'Unit Price': 'Price',
+    'Price Per Unit': 'Price',
+
+    # Standard: 'Date'
+    'Invoice Date': 'Date',
+}
+
+# Columns the analysis actually uses (after strip/title normalization):
+# every alias above plus the standard names and derivation inputs.
+_REQUIRED_COLUMNS = frozenset(_COLUMN_MAPPING) | frozenset([
+    'Date', 'Quantity', 'Price', 'Sku', 'Store', 'Total', 'Weekly_Sales',
+])
+
+
+# Date formats seen across the supported dataset families.
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d-%m-%Y", "%d/%m/%Y")
+
+
+def _parse_dates(col):
+    """Parse a Date column, detecting an explicit format from sample values.
+
+    An explicit format keeps pd.to_datetime on the vectorized strptime
+    path instead of falling back to per-element dateutil parsing. A
+    candidate format must match every probed sample — one row isn't
+    enough to disambiguate day-first from month-first files — and if it
+    still fails somewhere in the full column we fall back to
+    format-less parsing rather than silently coercing rows to NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    samples = [str(v) for v in col.dropna().head(20)]
+    if samples:
+        for fmt in _DATE_FORMATS:
+            try:
+                for s in samples:
+                    datetime.strptime(s, fmt)
+            except ValueError:
+                continue
+            try:
+                return pd.to_datetime(col, format=fmt, cache=True)
+            except ValueError:
+                break  # matched the samples but not the whole column
+    try:
+        return pd.to_datetime(col, cache=True)
+    except ValueError:
+        # Genuinely mixed formats: infer per element rather than fail.
+        return pd.to_datetime(col, format='mixed', cache=True)
+
+
+def _read_table(file):
+    """Read the upload (CSV or Excel), parsing only the columns we need."""
     try:
-        df = pd.read_csv(file)
+        # Cheap header-only pass so the real read can prune columns.
+        header = pd.read_csv(file, nrows=0)
+        file.seek(0)
+        usecols = [c for c in header.columns if c.strip().title() in _REQUIRED_COLUMNS]
+        try:
+            # Block-parallel streaming parse: pyarrow decodes 1 MiB
+            # blocks across threads, so peak RAM is a few blocks rather
+            # than a second full copy of the decoded file.
+            tbl = pa_csv.read_csv(
+                file,
+                read_options=pa_csv.ReadOptions(use_threads=True, block_size=1 << 20),
+                convert_options=pa_csv.ConvertOptions(include_columns=usecols or None),
+            )
+            return tbl.to_pandas()
+        except pa.ArrowInvalid:
+            file.seek(0)
+            return pd.read_csv(file, usecols=usecols or None)
     except Exception:
-        df = pd.read_excel(file)
-    
-    # 2. Clean Column Names (Remove spaces, Title Case)
-    # e.g., "Product line " -> "Product Line"
-    df.columns = [c.strip().title() for c in df.columns]
-    
-    # 3. Define Intelligent Mapping (Your Logic + Enhancements)
-    # We map various possible names to our Standard Internal Names
-    column_mapping = {
-        # Standard: 'Store'
-        'Branch': 'Store', 
-        'Store Name': 'Store',
-        
-        # Standard: 'SKU' (We treat Product Line or Dept as SKU for analysis)
-        'Product Line': 'SKU', 
-        'Dept': 'SKU',
-        'Category': 'SKU',
-
-        # Standard: 'Quantity' (Crucial for EOQ)
-        'Qty': 'Quantity',
-        'Sales Qty': 'Quantity',
-        
-        # Standard: 'Price'
-        'Unit Price': 'Price',
-        'Price Per Unit': 'Price',
-        
-        # Standard: 'Date'
-        'Invoice Date': 'Date'
-    }
-    
-    # Apply renaming only for columns that exist
-    df = df.rename(columns=column_mapping)
-    
+        file.seek(0)
+        try:
+            return pd.read_excel(file, engine="calamine")
+        except Exception:
+            file.seek(0)
+            return pd.read_excel(file)
+
+
+# On-disk cache of processed frames, keyed by upload content hash.
+_CACHE_DIR = Path(".inventory_cache")
+
+
+def load_and_process_data(file):
+    # Thin session-facing wrapper: hash the upload's bytes and hand them
+    # to the process-wide cache, so every session shares one frame
+    # instead of holding its own pickled copy.
+    data = file.getvalue()
+    key = hashlib.blake2b(data, digest_size=16).hexdigest()
+    try:
+        return _load_raw(key, data)
+    except ValueError as err:
+        st.error(str(err))
+        return None
+
+
+@st.cache_resource(max_entries=4)
+def _load_raw(bytes_hash, data):
+    # 0. Second cache tier: a Parquet file keyed by the upload's content
+    # hash. Re-uploads and fresh sessions become a cheap columnar read
+    # instead of a full re-parse, and the frame isn't re-pickled in RAM.
+    cache_path = _CACHE_DIR / f"{bytes_hash}.parquet"
+    if cache_path.exists():
+        try:
+            return pd.read_parquet(cache_path, engine="pyarrow")
+        except Exception:
+            # Corrupt entry (e.g. an interrupted write): drop it and
+            # fall through to a full re-parse.
+            cache_path.unlink(missing_ok=True)
+
+    # 1. Read Data (Try CSV first, then Excel)
+    df = _read_table(io.BytesIO(data))
+
+    # 2+3. Clean Column Names & Apply the Intelligent Mapping in a single
+    # rename pass, e.g. "Product line " -> "Product Line" -> "SKU".
+    df = df.rename(columns=lambda c: _COLUMN_MAPPING.get((n := c.strip().title()), n))
+
     # 4. Data Validation & Filling Gaps
     # Check Date
     if 'Date' in df.columns:
-        df['Date'] = pd.to_datetime(df['Date'])
+        df['Date'] = _parse_dates(df['Date'])
     else:
-        st.error("❌ Critical Error: No 'Date' column found.")
-        return None
+        raise ValueError("❌ Critical Error: No 'Date' column found.")
 
     # Check Quantity (If missing, try to derive from Total / Price)
     if 'Quantity' not in df.columns:
         if 'Total' in df.columns and 'Price' in df.columns:
-            df['Quantity'] = (df['Total'] / df['Price']).astype(int)
-        elif 'Weekly_Sales' in df.columns:
+            # Divide on the raw ndarrays straight into a preallocated
+            # int32 buffer — no float64 temporary, half the output width.
+            qty = np.empty(len(df), dtype=np.int32)
+            np.divide(df['Total'].to_numpy(), df['Price'].to_numpy(),
+                      out=qty, casting='unsafe')
+            df['Quantity'] = qty
+        elif 'Weekly_Sales' in df.columns and 'SKU' in df.columns:
             # Fallback for old Walmart data (Simulate Price)
-            np.random.seed(42)
-            df['Price'] = np.random.randint(10, 100, size=len(df))
+            # One seeded draw per unique Dept/SKU instead of per row, so
+            # rows of the same product share a price and the legacy
+            # global np.random state is left untouched.
+            codes, uniques = pd.factorize(df['SKU'], sort=False)
+            rng = np.random.default_rng(42)
+            lut = rng.integers(10, 100, size=len(uniques), dtype=np.int16)
+            df['Price'] = lut[codes]
             df['Quantity'] = (df['Weekly_Sales'] / df['Price']).astype(int)
     
-    # Ensure Quantity is positive
+    # Drop input-only columns (Total, Weekly_Sales, ...) now that
+    # Quantity/Price are derived, so the row filter below doesn't copy
+    # columns the dashboard never reads.
+    is_walmart = 'Weekly_Sales' in df.columns
+    keep = [c for c in ('Date', 'SKU', 'Store', 'Quantity', 'Price') if c in df.columns]
+    df = df[keep]
+
+    # Ensure Dates parsed and Quantity is positive (mask on the raw
+    # ndarrays, skipping the intermediate boolean Series alignment).
+    # NaT rows must go: factorize would code them -1, which the panel
+    # kernel would treat as a negative bincount index.
+    mask = df['Date'].notna().to_numpy()
     if 'Quantity' in df.columns:
-        df = df[df['Quantity'] > 0]
+        mask = mask & (df['Quantity'].to_numpy() > 0)
+    df = df.iloc[mask]
 
     # Ensure SKU column exists
     if 'SKU' not in df.columns:
-        st.error("❌ Error: Could not identify a Product/Dept column.")
-        return None
+        raise ValueError("❌ Error: Could not identify a Product/Dept column.")
+
+    # 5. Store SKU as a Categorical: per-row integer codes plus one small
+    # labels array instead of O(N) Python strings, so the SKU filter and
+    # .unique() work on codes rather than objects.
+    if is_walmart and 'Store' in df.columns:
+        # Walmart data: a sellable unit is really a (Store, Dept) pair.
+        pair = pd.Series(list(zip(df['Store'], df['SKU'])), index=df.index)
+        codes, uniques = pd.factorize(pair)
+        labels = [f"Store {s} - Dept {d}" for s, d in uniques]
+        df['SKU'] = pd.Categorical.from_codes(codes, categories=labels)
+    else:
+        df['SKU'] = df['SKU'].astype(str).astype('category')
+
+    # Downcast numerics: quantities are small integers and prices
+    # two-decimal floats, so int64/float64 would double the bytes every
+    # downstream groupby has to stream.
+    if 'Quantity' in df.columns:
+        df['Quantity'] = pd.to_numeric(df['Quantity'], downcast='integer')
+    if 'Price' in df.columns:
+        df['Price'] = pd.to_numeric(df['Price'], downcast='float')
+
+    # Persist the cleaned frame for the second cache tier. Write to a
+    # temp file and rename into place so a process killed mid-write
+    # can't leave a truncated Parquet at the content-hash path.
+    _CACHE_DIR.mkdir(exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp{os.getpid()}")
+    df.to_parquet(tmp_path, compression="zstd", engine="pyarrow")
+    os.replace(tmp_path, cache_path)
 
     return df
 
+def _lttb(xs, ys, threshold=500):
+    """Largest-triangle-three-buckets downsampling of a line series.
+
+    Keeps at most `threshold` points while preserving the visual shape,
+    so the chart payload shipped to the browser stays small no matter
+    how many days of history a SKU has.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return xs, ys
+    x = xs.view('i8').astype(np.float64)
+    y = ys.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1, dtype=np.int64)
+    idx = np.empty(threshold, dtype=np.int64)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0  # last point kept
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i] + 1, edges[i + 1])
+        if i < threshold - 3:
+            nlo, nhi = edges[i + 1], max(edges[i + 1] + 1, edges[i + 2])
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # Largest triangle between the kept point, each candidate, and
+        # the next bucket's average.
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return xs[idx], ys[idx]
+
+
+def _sku_mask(df, sku):
+    """Boolean row mask for one SKU, compared on the categorical codes.
+
+    An int8/int16 equality scan instead of a per-row Python object
+    compare — SIMD-friendly and memory-bandwidth bound on large files.
+    """
+    col = df['SKU']
+    if hasattr(col, 'cat'):
+        return col.cat.codes.to_numpy() == col.cat.categories.get_loc(sku)
+    return (col == sku).to_numpy()
+
+
+@st.cache_data
+def precompute_daily_panel(df):
+    # A Date x SKU panel of daily quantities plus per-SKU mean prices,
+    # computed once per upload. Widget interactions then just slice one
+    # column instead of re-filtering and re-aggregating all N rows.
+    #
+    # The aggregation itself is a single scatter-add pass over raw code
+    # arrays (np.bincount on a flattened (date, sku) index) — one C
+    # loop over N rows, no pandas groupby dispatch or hash table.
+    date_codes, dates = pd.factorize(df['Date'], sort=True)
+    sku = df['SKU']
+    if hasattr(sku, 'cat'):
+        sku_codes = sku.cat.codes.to_numpy()
+        skus = sku.cat.categories
+    else:
+        sku_codes, skus = pd.factorize(sku)
+    n_skus = len(skus)
+    flat = date_codes.astype(np.int64) * n_skus + sku_codes
+    qty = df['Quantity'].to_numpy()
+    sums = np.bincount(flat, weights=qty, minlength=len(dates) * n_skus)
+    grid = sums.reshape(len(dates), n_skus)
+    if np.issubdtype(qty.dtype, np.integer):
+        # bincount sums into float64; exact for integer inputs, and
+        # weight-based (float) quantities must stay float.
+        grid = grid.astype(np.int64)
+    # Fortran order: slicing one SKU's column at widget time then reads
+    # a single contiguous slab instead of striding across rows.
+    grid = np.asfortranarray(grid)
+    panel = pd.DataFrame(grid, index=pd.Index(dates, name='Date'), columns=skus)
+    prices = df.groupby('SKU', observed=True)['Price'].mean() if 'Price' in df.columns else None
+    return panel, prices
+
+
+EOQResult = namedtuple('EOQResult', ['eoq', 'safety_stock', 'reorder_point', 'total_cost'])
+
+
+@st.cache_data
+def eoq_metrics(avg_daily_demand, avg_price, ordering_cost, holding_cost, lead_time):
+    # Pure scalar math with a five-float cache key: this is the only
+    # layer that re-runs on a slider move, and repeated parameter
+    # combinations don't even pay that.
+    annual_demand = avg_daily_demand * 365
+    # math.sqrt: these are scalars, no reason to pay ufunc dispatch
+    eoq = sqrt((2 * annual_demand * ordering_cost) / (avg_price * holding_cost))
+
+    # Safety Stock (Simple Formula, 95% service level)
+    safety_stock = avg_daily_demand * lead_time * 1.65
+    reorder_point = (avg_daily_demand * lead_time) + safety_stock
+
+    # Total Inventory Cost (Estimated)
+    total_cost = (annual_demand / eoq) * ordering_cost + (eoq / 2) * avg_price * holding_cost
+    return EOQResult(eoq, safety_stock, reorder_point, total_cost)
+
+
 # ---------------------------------------------------------
 # 3. Main App Logic
 # ---------------------------------------------------------
@@ -104,8 +356,18 @@ if uploaded_file is not None:
         # --- Sidebar Controls ---
         st.sidebar.header("⚙️ Supply Chain Parameters")
         
-        # Select SKU
-        sku_list = sorted(df['SKU'].unique().astype(str))
+        # Select SKU — read the Categorical's K categories directly
+        # instead of re-scanning all N rows on every widget rerun
+        sku = df['SKU']
+        if hasattr(sku, 'cat'):
+            sku_list = sorted(map(str, sku.cat.categories))
+        else:
+            sku_list = sorted(sku.unique().astype(str))
+        if not sku_list:
+            # Every row was filtered out (e.g. a returns-only file with
+            # no positive quantities) — nothing to select or slice.
+            st.warning("No products with positive sales found in this file.")
+            st.stop()
         selected_sku = st.sidebar.selectbox("Select Product Line / Category", sku_list)
         
         # Parameters
@@ -114,53 +376,63 @@ if uploaded_file is not None:
         ordering_cost = st.sidebar.number_input("Fixed Ordering Cost ($)", value=50)
 
         # --- Calculations ---
-        # Filter data for selected SKU
-        sku_data = df[df['SKU'] == selected_sku].sort_values('Date')
-        
-        # Aggregate Daily Sales (in case of multiple orders per day)
-        daily_sales = sku_data.groupby('Date')['Quantity'].sum().reset_index()
-        
+        # Filter data for selected SKU (for the raw-data tab; no need to
+        # sort M rows just to show them — the daily panel is already
+        # date-sorted once at precompute time)
+        sku_data = df.iloc[_sku_mask(df, selected_sku)]
+
+        # Daily Sales: slice the precomputed panel (days with no sales
+        # for this SKU carry a 0 fill and are dropped)
+        daily_panel, sku_prices = precompute_daily_panel(df)
+        series = daily_panel[selected_sku]
+        daily_sales = series[series > 0].rename('Quantity').reset_index()
+
         if len(daily_sales) > 0:
-            # Metrics
-            avg_daily_demand = daily_sales['Quantity'].mean()
-            if 'Price' in sku_data.columns:
-                avg_price = sku_data['Price'].mean()
+            # Metrics (reduce on the raw ndarray — the column is known
+            # non-null here, so pandas' NA-handling path is pure overhead)
+            avg_daily_demand = daily_sales['Quantity'].to_numpy().mean()
+            if sku_prices is not None:
+                avg_price = float(sku_prices[selected_sku])
             else:
-                avg_price = 50 # Fallback default
-            
-            # EOQ Calculation
-            annual_demand = avg_daily_demand * 365
-            eoq = np.sqrt((2 * annual_demand * ordering_cost) / (avg_price * holding_cost))
-            
-            # Safety Stock Calculation (Simple Formula)
-            safety_stock = avg_daily_demand * lead_time * 1.65 # 95% service level
-            reorder_point = (avg_daily_demand * lead_time) + safety_stock
+                avg_price = 50.0 # Fallback default
             
-            # Total Inventory Cost (Estimated)
-            total_cost = (annual_demand/eoq)*ordering_cost + (eoq/2)*avg_price*holding_cost
+            # EOQ / Safety Stock / Cost (cached scalar layer)
+            res = eoq_metrics(float(avg_daily_demand), avg_price,
+                              ordering_cost, holding_cost, lead_time)
 
             # --- Dashboard Display ---
             st.markdown(f"### 📊 Optimization Results: {selected_sku}")
             
             # Key Metrics Row
             col1, col2, col3, col4 = st.columns(4)
-            col1.metric("📦 Economical Order Qty (EOQ)", f"{int(eoq)} units", delta="Batch Size")
-            col2.metric("🛡️ Safety Stock", f"{int(safety_stock)} units", delta="Buffer")
-            col3.metric("⚠️ Reorder Point", f"{int(reorder_point)} units", delta="Trigger Level")
-            col4.metric("💰 Est. Annual Cost", f"${int(total_cost):,}", help="Ordering + Holding Costs")
+            col1.metric("📦 Economical Order Qty (EOQ)", f"{int(res.eoq)} units", delta="Batch Size")
+            col2.metric("🛡️ Safety Stock", f"{int(res.safety_stock)} units", delta="Buffer")
+            col3.metric("⚠️ Reorder Point", f"{int(res.reorder_point)} units", delta="Trigger Level")
+            col4.metric("💰 Est. Annual Cost", f"${int(res.total_cost):,}", help="Ordering + Holding Costs")
 
             # Charts
             tab1, tab2 = st.tabs(["📈 Demand Trend", "📋 Raw Data"])
             
             with tab1:
-                fig = px.line(daily_sales, x='Date', y='Quantity', 
+                chart_data = daily_sales
+                if len(daily_sales) > 500:
+                    # Decimate long histories; ~500 points are plenty
+                    # of pixels for a line chart.
+                    xs, ys = _lttb(daily_sales['Date'].to_numpy(),
+                                   daily_sales['Quantity'].to_numpy())
+                    chart_data = pd.DataFrame({'Date': xs, 'Quantity': ys})
+                fig = px.line(chart_data, x='Date', y='Quantity',
                               title=f'Daily Demand Velocity - {selected_sku}',
                               markers=True)
                 fig.update_traces(line_color='#1f77b4')
                 st.plotly_chart(fig, use_container_width=True)
                 
             with tab2:
-                st.dataframe(sku_data.head(100))
+                # Hand Streamlit an Arrow table of just the shown
+                # columns — skips the pandas-styler path entirely.
+                shown = [c for c in ('Date', 'SKU', 'Quantity', 'Price') if c in sku_data.columns]
+                preview = pa.Table.from_pandas(sku_data[shown].head(100), preserve_index=False)
+                st.dataframe(preview, use_container_width=True)
                 
         else:
             st.warning("Not enough data to calculate metrics for this product.")